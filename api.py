@@ -1,11 +1,16 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import codecs
 import csv
-from io import StringIO
+import functools
 from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
 import logging
+import numpy as np
+from numba import njit
 
 # Configure logging
 logging.basicConfig(
@@ -14,7 +19,16 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Compile the numba kernels before the first request has to wait on them
+    logger.info("Warming up cost calculation kernels")
+    calculate_monthly_costs('EBS', 1.0)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Pricing map for warm and cold storage (per GB-month)
 PRICE_MAP = {
@@ -48,123 +62,221 @@ class CostResponse(BaseModel):
     monthly_costs: List[MonthlyCostItem]
 
 
-def calculate_monthly_costs(resource_type: str, size_gb: float, job_name: Optional[str] = None):
-    print(f"\nCalculating costs for {resource_type} ({size_gb}GB) with {job_name} schedule...")
-    
-    if resource_type not in PRICE_MAP:
+# Schedules are simulated on an integer grid of hours from the start date
+HOUR = timedelta(hours=1)
+HOURS_PER_DAY = 24
+
+
+# relativedelta construction is surprisingly costly, so build the offsets once
+MONTH_OFFSETS = tuple(relativedelta(months=i) for i in range(13))
+
+
+def _hours(delta: timedelta) -> int:
+    return delta // HOUR
+
+
+class _Schedule(NamedTuple):
+    """A backup schedule resolved to the month-invariant values the simulation needs."""
+    name: str
+    interval_hours: Optional[int]  # None for calendar (relativedelta) intervals
+    reldelta: Optional[relativedelta]
+    retention_hours: int
+    cold_after_hours: int  # 0 when recovery points never move to cold storage
+    warm_cap_hours: int
+
+
+def _compile_schedule(sched: dict) -> _Schedule:
+    interval = sched['interval']
+    is_reldelta = isinstance(interval, relativedelta)
+    retention = _hours(sched['retention'])
+    cold_after = _hours(sched['cold_after']) if sched['cold_after'] else 0
+    return _Schedule(
+        name=sched['name'],
+        interval_hours=None if is_reldelta else _hours(interval),
+        reldelta=interval if is_reldelta else None,
+        retention_hours=retention,
+        cold_after_hours=cold_after,
+        warm_cap_hours=min(cold_after or retention, retention),
+    )
+
+
+# SCHEDULES converted once at import, with a name lookup for single jobs
+_COMPILED_SCHEDULES = tuple(_compile_schedule(sched) for sched in SCHEDULES)
+_SCHEDULES_BY_NAME = {sched.name: sched for sched in _COMPILED_SCHEDULES}
+
+_VALID_RESOURCE_TYPES = frozenset(PRICE_MAP)
+_VALID_JOB_NAMES = frozenset(_SCHEDULES_BY_NAME)
+
+
+def _validate(resource_type: str, job_name: Optional[str]):
+    if resource_type not in _VALID_RESOURCE_TYPES:
         raise ValueError(f"Unsupported resource type: {resource_type}")
+    if job_name is not None and job_name not in _VALID_JOB_NAMES:
+        raise ValueError(f"Unknown backup job: {job_name}")
+
+
+@functools.lru_cache(maxsize=4)
+def _month_bounds(start_date: date):
+    """
+    Hour offsets from start_date of where each of the next 12 months starts
+    and ends. Cached since the start date only changes once a day; the
+    arrays are read-only as they are shared between calls.
+
+    Returns:
+        tuple: (month start offsets, month end offsets, hours in each month)
+        as int64 arrays
+    """
+    starts = []
+    ends = []
+    for month_index in range(1, 13):
+        month_start = start_date + MONTH_OFFSETS[month_index-1]
+        month_end = month_start + MONTH_OFFSETS[1]
+        starts.append((month_start - start_date).days * HOURS_PER_DAY)
+        ends.append((month_end - start_date).days * HOURS_PER_DAY)
+
+    bounds = (np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64))
+    bounds += (bounds[1] - bounds[0],)
+    for array in bounds:
+        array.setflags(write=False)
+    return bounds
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _clipped_sum(first_gap, interval, count, cap):
+    """
+    Sum min(cap, max(gap, 0)) over `count` gaps that start at `first_gap`
+    and shrink by `interval` for every subsequent recovery point.
+    """
+    if count <= 0 or first_gap <= 0 or cap <= 0:
+        return 0
+
+    # Recovery points whose gap reaches the cap contribute the full cap
+    full = 0
+    if first_gap >= cap:
+        full = min((first_gap - cap) // interval + 1, count)
+    # The rest contribute their (positive) gap, an arithmetic series
+    positive = min(-(-first_gap // interval), count)
+    partial = positive - full
+    partial_gap = first_gap - interval * full
+    return cap * full + partial_gap * partial - interval * (partial * (partial - 1) // 2)
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _fixed_interval_kernel(month_starts, month_ends, interval, warm_cap, cold_after, retention):
+    """
+    Warm and cold hours per month for a schedule taking a recovery point
+    every `interval` hours from the start date. A `cold_after` of 0
+    disables the cold tier.
+    """
+    months = month_starts.shape[0]
+    warm = np.zeros(months, dtype=np.int64)
+    cold = np.zeros(months, dtype=np.int64)
+    for i in range(months):
+        # Recovery points inside the month form an arithmetic sequence
+        first_rp = -(-month_starts[i] // interval)
+        end_rp = -(-month_ends[i] // interval)
+        count = end_rp - first_rp
+        first_gap = month_ends[i] - interval * first_rp
+
+        warm[i] = _clipped_sum(first_gap, interval, count, warm_cap)
+        if cold_after > 0:
+            cold[i] = _clipped_sum(first_gap - cold_after, interval, count, retention - cold_after)
+    return warm, cold
+
+
+def _schedule_hours(sched: _Schedule, start_date: date, month_starts: np.ndarray, month_ends: np.ndarray, with_cold: bool):
+    """
+    Warm and cold storage hours accrued within each month by the recovery
+    points a schedule takes during that month.
+
+    Returns:
+        tuple: (warm hours per month, cold hours per month)
+    """
+    retention = sched.retention_hours
+    cold_after = sched.cold_after_hours if with_cold else 0
+    warm_cap = sched.warm_cap_hours
+
+    if sched.reldelta is not None:
+        # Calendar intervals yield few recovery points, so enumerate them and
+        # measure each one against the end of the month it was taken in
+        rp_hours = []
+        rp_time = start_date
+        rp_offset = 0
+        horizon = month_ends.max()
+        while rp_offset < horizon:
+            rp_hours.append(rp_offset)
+            rp_time += sched.reldelta
+            rp_offset = (rp_time - start_date).days * HOURS_PER_DAY
+        rp_hours = np.array(rp_hours, dtype=np.int64)
+
+        in_month = (rp_hours[None, :] >= month_starts[:, None]) & (rp_hours[None, :] < month_ends[:, None])
+        gaps = np.where(in_month, month_ends[:, None] - rp_hours[None, :], 0)
+        warm = np.clip(gaps, 0, warm_cap).sum(axis=1)
+        cold = np.zeros_like(warm)
+        if cold_after:
+            cold = np.clip(gaps - cold_after, 0, retention - cold_after).sum(axis=1)
+        return warm, cold
+
+    return _fixed_interval_kernel(month_starts, month_ends, sched.interval_hours, warm_cap, cold_after, retention)
+
+
+@functools.lru_cache(maxsize=256)
+def _unit_costs(resource_type: str, job_name: Optional[str], start_date: date):
+    """
+    12-month costs for 1 GB of a resource. Costs scale linearly with size, so
+    this is cached and shared by every resource with the same type and job.
+    The start date is part of the key so cached results roll over each day.
+
+    Returns:
+        tuple: (month, cost per GB, ((schedule name, cost per GB), ...)) per month
+    """
     warm_price = PRICE_MAP[resource_type]['warm']
     cold_price = PRICE_MAP[resource_type]['cold']
 
     # Filter schedules if a specific job is requested
-    schedules_to_use = [sched for sched in SCHEDULES if job_name is None or sched['name'] == job_name]
-    if job_name and not schedules_to_use:
-        raise ValueError(f"Unknown backup job: {job_name}")
+    schedules_to_use = _COMPILED_SCHEDULES if job_name is None else (_SCHEDULES_BY_NAME[job_name],)
+
+    # Simulate all of the next 12 months at once
+    month_starts, month_ends, hours_in_month = _month_bounds(start_date)
+
+    month_costs = np.zeros(12)
+    breakdowns = [[] for _ in range(12)]
+
+    for sched in schedules_to_use:
+        warm, cold = _schedule_hours(sched, start_date, month_starts, month_ends, bool(cold_price))
+
+        sched_costs = (warm / hours_in_month) * warm_price
+        if cold_price:
+            sched_costs += (cold / hours_in_month) * cold_price
+
+        for breakdown, sched_cost in zip(breakdowns, sched_costs.tolist()):
+            breakdown.append((sched.name, sched_cost))
+        month_costs += sched_costs
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            f"Simulated {resource_type} with {job_name or 'all'} schedule(s) from {start_date}: "
+            f"12-month total ${round(month_costs.sum(), 6)} per GB"
+        )
+    return tuple(
+        (month_index, month_cost, tuple(breakdown))
+        for month_index, (month_cost, breakdown) in enumerate(zip(month_costs.tolist(), breakdowns), 1)
+    )
 
+
+def calculate_monthly_costs(resource_type: str, size_gb: float, job_name: Optional[str] = None):
+    _validate(resource_type, job_name)
+
+    # The values are produced here, so skip pydantic validation when building the items
     start_date = datetime.utcnow().date()
-    results = []
-
-    # Pre-calculate costs for different month lengths (28, 30, 31 days)
-    month_length_costs = {}
-    for days in [28, 30, 31]:
-        month_length_costs[days] = {}
-        for sched in schedules_to_use:
-            if sched['retention'].days >= 31:  # Skip optimization for retention >= 31 days
-                continue
-                
-            sched_cost = 0.0
-            rp_time = start_date
-            backup_points = 0
-            
-            # Calculate number of backup points in this month length
-            while rp_time < start_date + timedelta(days=days):
-                backup_points += 1
-                # Calculate warm days
-                warm_end = min(
-                    rp_time + (sched['cold_after'] or sched['retention']),
-                    rp_time + sched['retention'],
-                    start_date + timedelta(days=days)
-                )
-                warm_days = max((warm_end - rp_time).days, 0)
-
-                # Calculate cold days
-                cold_days = 0
-                if sched['cold_after'] and cold_price:
-                    cold_start = rp_time + sched['cold_after']
-                    if cold_start < start_date + timedelta(days=days):
-                        cold_end = min(rp_time + sched['retention'], start_date + timedelta(days=days))
-                        cold_days = max((cold_end - cold_start).days, 0)
-
-                # Add cost for this recovery point
-                sched_cost += size_gb * (warm_days / days) * warm_price
-                if cold_price:
-                    sched_cost += size_gb * (cold_days / days) * cold_price
-
-                rp_time += sched['interval']
-
-            month_length_costs[days][sched['name']] = round(sched_cost, 6)
-
-    # Simulate each of the next 12 months
-    for month_index in range(1, 13):
-        print(f"\nProcessing month {month_index}/12...")
-        month_start = start_date + relativedelta(months=month_index-1)
-        month_end = month_start + relativedelta(months=1)
-        days_in_month = (month_end - month_start).days
-
-        month_cost = 0.0
-        breakdown = {}
-
-        for sched in schedules_to_use:
-            print(f"  Processing {sched['name']} schedule...")
-            
-            if sched['retention'].days < 31 and days_in_month in month_length_costs:
-                # Use pre-calculated cost for this month length
-                sched_cost = month_length_costs[days_in_month].get(sched['name'], 0.0)
-            else:
-                # Calculate cost normally for longer retention periods
-                sched_cost = 0.0
-                rp_time = start_date
-                backup_points = 0
-                
-                # Move to first recovery point in or after month_start
-                while rp_time < month_start:
-                    rp_time += sched['interval']
-                
-                # Iterate recovery points within the month
-                while rp_time < month_end:
-                    backup_points += 1
-                    # Calculate warm days
-                    warm_end = min(
-                        rp_time + (sched['cold_after'] or sched['retention']),
-                        rp_time + sched['retention'],
-                        month_end
-                    )
-                    warm_days = max((warm_end - max(rp_time, month_start)).days, 0)
-
-                    # Calculate cold days
-                    cold_days = 0
-                    if sched['cold_after'] and cold_price:
-                        cold_start = rp_time + sched['cold_after']
-                        if cold_start < month_end:
-                            cold_end = min(rp_time + sched['retention'], month_end)
-                            cold_days = max((cold_end - max(cold_start, month_start)).days, 0)
-
-                    # Add cost for this recovery point
-                    sched_cost += size_gb * (warm_days / days_in_month) * warm_price
-                    if cold_price:
-                        sched_cost += size_gb * (cold_days / days_in_month) * cold_price
-
-                    rp_time += sched['interval']
-
-            print(f"    Processed {backup_points} backup points for {sched['name']}")
-            breakdown[sched['name']] = round(sched_cost, 6)
-            month_cost += sched_cost
-
-        results.append(MonthlyCostItem(month=month_index, cost=round(month_cost, 6), breakdown=breakdown))
-        print(f"  Month {month_index} total cost: ${round(month_cost, 2)}")
-
-    print("\nCalculation complete!")
-    return results
+    return [
+        MonthlyCostItem.model_construct(
+            month=month_index,
+            cost=round(size_gb * month_cost, 6),
+            breakdown={name: round(size_gb * sched_cost, 6) for name, sched_cost in breakdown},
+        )
+        for month_index, month_cost, breakdown in _unit_costs(resource_type, job_name, start_date)
+    ]
 
 
 @app.post("/calculate", response_model=CostResponse)
@@ -176,7 +288,7 @@ async def calculate_cost_json(resource: Resource):
     except ValueError as e:
         logger.error(f"Error calculating costs: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
-    return CostResponse(resource=resource, monthly_costs=costs)
+    return CostResponse.model_construct(resource=resource, monthly_costs=costs)
 
 
 @app.post("/calculate_csv", response_model=List[CostResponse])
@@ -187,29 +299,54 @@ async def calculate_cost_csv(file: UploadFile = File(...)):
         logger.error(f"Invalid file type: {file.filename}")
         raise HTTPException(status_code=400, detail="Only CSV files are supported")
     
-    logger.info("Reading CSV file content")
-    content = await file.read()
-    
-    decoded = content.decode('utf-8')
-    logger.info("CSV file decoded successfully")
-    
-    reader = csv.DictReader(StringIO(decoded))
-    responses = []
-    
-    logger.info("Processing CSV rows")
-    for row in reader:
-        rt = row.get('type')
-        size = float(row.get('size_gb', 0))
-        job = row.get('job') or None
-        logger.info(f"Processing row: type={rt}, size={size}, job={job}")
-        
-        try:
-            costs = calculate_monthly_costs(rt, size, job)
-            responses.append(CostResponse(resource=Resource(type=rt, size_gb=size, job=job), monthly_costs=costs))
-            logger.info(f"Successfully calculated costs for {rt} ({size}GB)")
-        except ValueError as e:
-            logger.error(f"Error processing row: {str(e)}")
-            raise HTTPException(status_code=400, detail=str(e))
+    # Stream rows straight from the spooled upload rather than buffering and
+    # decoding the whole file, and read them positionally. The upload may be
+    # spooled to disk, so parse it in a worker thread, off the event loop
+    def read_rows():
+        logger.info("Reading CSV file content")
+        # SpooledTemporaryFile can't be wrapped in a TextIOWrapper before
+        # Python 3.11, so decode its lines incrementally instead
+        reader = csv.reader(codecs.iterdecode(file.file, 'utf-8'))
+        columns = {name: index for index, name in enumerate(next(reader, []))}
+
+        def column(row, name, default=None):
+            index = columns.get(name)
+            return row[index] if index is not None and index < len(row) else default
+
+        rows = []
+        for row in reader:
+            if not row:
+                continue
+            rt = column(row, 'type')
+            size = float(column(row, 'size_gb', 0))
+            job = column(row, 'job') or None
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Processing row: type={rt}, size={size}, job={job}")
+
+            # Reject bad rows before starting any of the calculations
+            try:
+                _validate(rt, job)
+            except ValueError as e:
+                logger.error(f"Error processing row: {str(e)}")
+                raise HTTPException(status_code=400, detail=str(e))
+            rows.append((rt, size, job))
+        return rows
+
+    rows = await asyncio.to_thread(read_rows)
+
+    # Rows are mostly cache hits scaled in pure Python, so threads can't run
+    # them in parallel; hand the whole batch to one worker thread to keep the
+    # event loop free without paying a thread hop per row
+    logger.info(f"Processing {len(rows)} CSV rows")
+    all_costs = await asyncio.to_thread(lambda: [calculate_monthly_costs(*row) for row in rows])
+
+    responses = [
+        CostResponse.model_construct(
+            resource=Resource.model_construct(type=rt, size_gb=size, job=job),
+            monthly_costs=costs,
+        )
+        for (rt, size, job), costs in zip(rows, all_costs)
+    ]
     
     logger.info(f"Successfully processed {len(responses)} resources from CSV")
     return responses
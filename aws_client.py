@@ -0,0 +1,43 @@
+"""
+Shared boto3 clients for the AWS discovery scripts.
+"""
+import functools
+
+import boto3
+from botocore.config import Config
+
+# Adaptive retries back off when AWS throttles the concurrent paginations, and
+# the larger pool keeps their TLS connections open for reuse
+CLIENT_CONFIG = Config(
+    retries={'mode': 'adaptive', 'max_attempts': 10},
+    max_pool_connections=50,
+)
+
+def create_client(service_name, region=None):
+    """
+    Create a new boto3 client for an AWS service with the shared configuration.
+    Use this rather than get_client for a client whose event hooks you change,
+    so the shared client keeps its standard behaviour.
+
+    Args:
+        service_name (str): The AWS service, e.g. 'ec2' or 'ebs'
+        region (str, optional): AWS region name
+
+    Returns:
+        botocore.client.BaseClient: The new client
+    """
+    return boto3.client(service_name, region_name=region, config=CLIENT_CONFIG)
+
+@functools.lru_cache(maxsize=None)
+def get_client(service_name, region=None):
+    """
+    Get a boto3 client for an AWS service, created once per service and region.
+
+    Args:
+        service_name (str): The AWS service, e.g. 'ec2' or 'ebs'
+        region (str, optional): AWS region name
+
+    Returns:
+        botocore.client.BaseClient: The shared client
+    """
+    return create_client(service_name, region)
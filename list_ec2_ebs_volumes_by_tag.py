@@ -1,17 +1,33 @@
 #!/usr/bin/env python3
 
-import boto3
 import csv
 import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from aws_client import get_client
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Number of instance IDs to put in one describe_volumes filter (EC2 allows 200)
+INSTANCE_FILTER_BATCH_SIZE = 200
+
+# Number of describe_volumes paginations to run concurrently
+MAX_WORKERS = 8
 
 def get_ec2_volumes_by_tag(tag_key):
-    ec2 = boto3.client('ec2')
+    ec2 = get_client('ec2')
     logger.info(f"Searching for EC2 instances with tag key: {tag_key}")
     
     # find instances with the tag key
     paginator = ec2.get_paginator('describe_instances')
     filters = [{'Name': f'tag-key', 'Values': [tag_key]}]
-    rows = []
+    tag_values = {}
 
     for page in paginator.paginate(Filters=filters):
         for inst in page['Reservations']:
@@ -30,29 +46,44 @@ def get_ec2_volumes_by_tag(tag_key):
                     continue
 
                 logger.info(f"Found tag value '{tag_value}' for instance {instance_id}")
+                tag_values[instance_id] = tag_value
 
-                # for each block device mapping, pull the volume size
-                for mapping in i.get('BlockDeviceMappings', []):
-                    ebs = mapping.get('Ebs')
-                    if not ebs or 'VolumeId' not in ebs:
-                        logger.warning(f"No EBS volume found for device {mapping.get('DeviceName')} on instance {instance_id}")
-                        continue
+    # let EC2 filter volumes by the instances they're attached to, instead of
+    # walking every block device mapping and describing volumes one by one
+    volume_paginator = ec2.get_paginator('describe_volumes')
+    instance_ids = list(tag_values)
+
+    def describe_batch(batch):
+        batch = set(batch)
+        volume_filters = [{'Name': 'attachment.instance-id', 'Values': sorted(batch)}]
+        logger.info(f"Describing volumes attached to {len(batch)} instances")
+        batch_rows = []
 
-                    volume_id = ebs['VolumeId']
-                    logger.info(f"Processing volume {volume_id} for instance {instance_id}")
+        # errors are left to propagate (after the client's adaptive retries):
+        # a failed batch would silently drop every volume of up to 200
+        # instances from a CSV that still looks complete
+        for page in volume_paginator.paginate(Filters=volume_filters, PaginationConfig={'PageSize': 500}):
+            for vol in page['Volumes']:
+                for attachment in vol.get('Attachments', []):
+                    instance_id = attachment['InstanceId']
+                    if instance_id not in batch:
+                        continue
 
-                    try:
-                        vol = ec2.describe_volumes(VolumeIds=[volume_id])['Volumes'][0]
-                        size_gb = vol['Size']
-                        logger.info(f"Volume {volume_id} size: {size_gb}GB")
+                    logger.info(f"Volume {vol['VolumeId']} on instance {instance_id} size: {vol['Size']}GB")
+                    batch_rows.append({
+                        'type':        'EBS',
+                        'size_gb':     vol['Size'],
+                        'ec2_tag_value': tag_values[instance_id]
+                    })
+        return batch_rows
 
-                        rows.append({
-                            'type':        'EBS',
-                            'size_gb':     size_gb,
-                            'ec2_tag_value': tag_value
-                        })
-                    except Exception as e:
-                        logger.error(f"Error describing volume {volume_id}: {e}")
+    # each batch is its own pagination, so page through them concurrently
+    batches = [
+        instance_ids[start:start + INSTANCE_FILTER_BATCH_SIZE]
+        for start in range(0, len(instance_ids), INSTANCE_FILTER_BATCH_SIZE)
+    ]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        rows = [row for batch_rows in executor.map(describe_batch, batches) for row in batch_rows]
 
     logger.info(f"Found {len(rows)} EBS volumes across all instances")
     return rows
@@ -75,11 +106,10 @@ def main():
     rows = get_ec2_volumes_by_tag(args.tag_key)
 
     logger.info(f"Writing {len(rows)} rows to {args.output}")
-    with open(args.output, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=['type','size_gb','ec2_tag_value'])
-        writer.writeheader()
-        for r in rows:
-            writer.writerow(r)
+    with open(args.output, 'w', newline='', buffering=1 << 20) as f:
+        writer = csv.writer(f)
+        writer.writerow(['type','size_gb','ec2_tag_value'])
+        writer.writerows((r['type'], r['size_gb'], r['ec2_tag_value']) for r in rows)
 
     logger.info(f"Successfully wrote {len(rows)} rows to {args.output}")
 
@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
 
-import boto3
 import argparse
 import logging
 from datetime import datetime
 
+from aws_client import get_client
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -24,7 +25,7 @@ def get_volume_snapshots(volume_id, region=None):
         list: List of snapshots with their details
     """
     logger.info(f"Connecting to EC2 in region: {region or 'default'}")
-    ec2 = boto3.client('ec2', region_name=region)
+    ec2 = get_client('ec2', region)
     
     try:
         # First verify the volume exists
@@ -1,11 +1,60 @@
 #!/usr/bin/env python3
 import argparse
+import bisect
+import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
 from botocore.exceptions import ClientError
 
-def get_snapshot_percentage(ec2, snapshot_id):
+from aws_client import create_client, get_client
+
+BYTES_PER_BLOCK = 512 * 1024
+
+# Number of block index ranges listed concurrently per snapshot
+MAX_WORKERS = 8
+
+# Largest page ListSnapshotBlocks will return (the default is far smaller)
+MAX_BLOCKS_PER_PAGE = 10000
+
+BLOCK_INDEX_PATTERN = re.compile(rb'"BlockIndex"\s*:\s*(\d+)')
+BLOCKS_PATTERN = re.compile(rb'"Blocks"\s*:\s*\[[^\]]*\]')
+
+def keep_block_indexes_only(response_dict, customized_response_dict, **kwargs):
+    """
+    botocore before-parse hook for ListSnapshotBlocks that reduces each block
+    to its index, so neither botocore nor json builds a dict and BlockToken
+    string for every stored block only for them to be counted and thrown away.
+    The indexes are scanned straight out of the raw body, and the Blocks
+    array is emptied before botocore parses what's left.
+    """
+    if response_dict['status_code'] != 200:
+        return
+    body = response_dict['body']
+    customized_response_dict['BlockIndexes'] = [int(m.group(1)) for m in BLOCK_INDEX_PATTERN.finditer(body)]
+    response_dict['body'] = BLOCKS_PATTERN.sub(b'"Blocks":[]', body, count=1)
+
+def count_snapshot_blocks(ebs, snapshot_id, start_index, end_index):
+    """
+    Count the blocks stored in a snapshot with start_index <= BlockIndex < end_index.
+    """
+    block_count = 0
+    params = {'SnapshotId': snapshot_id, 'StartingBlockIndex': start_index, 'MaxResults': MAX_BLOCKS_PER_PAGE}
+    while True:
+        resp = ebs.list_snapshot_blocks(**params)
+        indexes = resp.get('BlockIndexes')
+        if indexes is None:
+            indexes = [block['BlockIndex'] for block in resp.get('Blocks', [])]
+        # Blocks come back in index order, so stop at the first page that
+        # runs past the end of this range
+        if indexes and indexes[-1] >= end_index:
+            return block_count + bisect.bisect_left(indexes, end_index)
+        block_count += len(indexes)
+        if not resp.get('NextToken'):
+            return block_count
+        params = {'SnapshotId': snapshot_id, 'NextToken': resp['NextToken'], 'MaxResults': MAX_BLOCKS_PER_PAGE}
+
+def get_snapshot_percentage(ec2, ebs, snapshot_id):
     # 1) Describe the snapshot to get the source volume size (GiB)
     try:
         resp = ec2.describe_snapshots(SnapshotIds=[snapshot_id])
@@ -20,19 +69,22 @@ def get_snapshot_percentage(ec2, snapshot_id):
 
     volume_size_gib = snaps[0]['VolumeSize']
 
-    # 2) Paginate ListSnapshotBlocks to count how many 512 KiB blocks are stored
-    paginator = ec2.get_paginator('list_snapshot_blocks')
-    block_count = 0
+    # 2) Count how many 512 KiB blocks are stored. Each NextToken page depends
+    #    on the one before it, so split the block index space into ranges and
+    #    page through them concurrently instead
+    total_blocks = volume_size_gib * (1024**3 // BYTES_PER_BLOCK)
+    # No range smaller than a page, so small snapshots aren't split needlessly
+    range_size = max(-(-total_blocks // MAX_WORKERS), MAX_BLOCKS_PER_PAGE)
+    ranges = [(start, start + range_size) for start in range(0, total_blocks, range_size)]
     try:
-        for page in paginator.paginate(SnapshotId=snapshot_id):
-            blocks = page.get('Blocks', [])
-            block_count += len(blocks)
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            counts = executor.map(lambda r: count_snapshot_blocks(ebs, snapshot_id, *r), ranges)
+            block_count = sum(counts)
     except ClientError as e:
         print(f"ERROR listing blocks for {snapshot_id}: {e}", file=sys.stderr)
         return None
 
     # 3) Compute sizes
-    BYTES_PER_BLOCK = 512 * 1024
     snapshot_bytes = block_count * BYTES_PER_BLOCK
     volume_bytes   = volume_size_gib * 1024**3
 
@@ -57,10 +109,15 @@ def main():
         help="One or more EBS snapshot IDs")
     args = parser.parse_args()
 
-    ec2 = boto3.client('ec2', region_name=args.region)
+    ec2 = get_client('ec2', args.region)
+    # ListSnapshotBlocks is part of the EBS direct APIs, not the EC2 API. The
+    # client is our own, not the shared one, since the hook changes the shape
+    # of its ListSnapshotBlocks responses
+    ebs = create_client('ebs', args.region)
+    ebs.meta.events.register('before-parse.ebs.ListSnapshotBlocks', keep_block_indexes_only)
 
     for snap_id in args.snapshots:
-        result = get_snapshot_percentage(ec2, snap_id)
+        result = get_snapshot_percentage(ec2, ebs, snap_id)
         if not result:
             continue
         print(f"{result['snapshot_id']}: "